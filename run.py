@@ -4,6 +4,9 @@ from pathlib import Path
 project_root = Path(__file__).parent
 src_path = project_root / 'src'
 sys.path.insert(0, str(src_path))
-from src.core.main import main
+from src.core.main import main, migrate
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if '--migrate' in sys.argv[1:]:
+        migrate()
+    else:
+        main()
\ No newline at end of file
@@ -8,9 +8,13 @@ class Config:
     CLICKHOUSE_USER = os.getenv('CLICKHOUSE_USER', 'default')
     CLICKHOUSE_PASSWORD = os.getenv('CLICKHOUSE_PASSWORD', '')
     CLICKHOUSE_DATABASE = os.getenv('CLICKHOUSE_DATABASE', 'solana')
+    CLICKHOUSE_POOL_SIZE = int(os.getenv('CLICKHOUSE_POOL_SIZE', '16'))
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', '100'))
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     SOLANA_HTTP_RPC_URL = os.getenv('SOLANA_HTTP_RPC_URL')
+    RPC_MAX_CONCURRENCY = int(os.getenv('RPC_MAX_CONCURRENCY', '8'))
+    DECIMALS_CACHE_PATH = os.getenv('DECIMALS_CACHE_PATH', 'data/decimals_cache.db')
+    DECIMALS_NOT_FOUND_TTL = int(os.getenv('DECIMALS_NOT_FOUND_TTL', '86400'))
     METAPLEX_PROGRAM_ID = os.getenv('METAPLEX_PROGRAM_ID', 'metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s')
     STABLECOINS = {'USDC': 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v', 'USDT': 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB'}
     SOL_ADDRESS = 'So11111111111111111111111111111111111111112'
@@ -4,6 +4,7 @@ from typing import List, Dict, Any
 from datetime import datetime
 from ..config import Config, setup_logging
 from ..database import get_db_client, ClickHouseClient
+from ..processors.token_utils import POW10, normalize_token
 from ..processors import TokenDiscovery, SupplyCalculator, PriceCalculator, MarketCapCalculator, LiquidityAnalyzer, FirstTxFinder, DecimalsResolver, MetadataFetcher
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -32,45 +33,38 @@ class TokenAggregationWorker:
             if not mints:
                 logger.warning('No mints found')
                 return 0
+            # Discovered mints are driver-decoded str; normalize once here and key every later step by it
+            normalized_mints = [normalize_token(mint) for mint in mints]
             logger.info('Step 2/5: Resolving token decimals via RPC')
-            decimals_map = self.decimals_resolver.resolve_decimals_batch(mints)
+            decimals_map = self.decimals_resolver.resolve_decimals_batch(normalized_mints)
             logger.info('Step 3/5: Fetching token metadata from Metaplex')
-            metadata_map = self.metadata_fetcher.resolve_metadata_batch(mints)
+            metadata_map = self.metadata_fetcher.resolve_metadata_batch(normalized_mints)
             logger.info('Step 4/5: Calculating supplies (batch)')
-            supplies = self.supply_calculator.calculate_supplies_batch(mints, decimals_map)
+            supplies = self.supply_calculator.calculate_supplies_batch(normalized_mints, decimals_map)
             logger.info('Getting burned amounts for each token (normalized)')
-            burned_amounts = {}
-            for mint in mints:
-                token_str = mint.decode('utf-8', errors='ignore') if isinstance(mint, (bytes, bytearray)) else str(mint)
-                token_str = token_str.replace('\x00', '').strip()
-                burned_raw = self.supply_calculator._get_total_burned(token_str)
-                decimals = decimals_map.get(token_str, 9)
-                burned_normalized = burned_raw / 10 ** decimals
-                burned_amounts[token_str] = burned_normalized
+            # Burned totals come from the same minted/burned batch query as the supplies
+            burned_raw_map = self.supply_calculator.get_last_burned()
+            burned_amounts = {token_str: burned_raw_map.get(token_str, 0) / POW10[decimals_map.get(token_str, 9)] for token_str in normalized_mints}
             logger.info('Step 5/5: Finding first transaction dates (batch)')
-            first_tx_dates = self.first_tx_finder.find_first_tx_dates_batch(mints)
+            first_tx_dates = self.first_tx_finder.find_first_tx_dates_batch(normalized_mints)
             sol_price = self.price_calculator.get_sol_price()
             if sol_price:
                 self.liquidity_analyzer.set_sol_price(sol_price)
-            logger.info('Calculating best pool metrics (batch)')
-            best_metrics = self.liquidity_analyzer.get_best_pool_metrics_batch(mints, decimals_map)
-            logger.info('Computing token reserves across pools for circulating supply')
-            reserves_map = self.liquidity_analyzer.get_token_reserves_map(mints, decimals_map)
+            logger.info('Calculating best pool metrics and token reserves (batch)')
+            best_metrics, reserves_map = self.liquidity_analyzer.analyze_pools_batch(normalized_mints, decimals_map)
             prices: Dict[str, float] = {}
             liquidities: Dict[str, float] = {}
             sources: Dict[str, str] = {}
             market_caps: Dict[str, float] = {}
-            for mint in mints:
-                token_str = mint.decode('utf-8', errors='ignore') if isinstance(mint, (bytes, bytearray)) else str(mint)
-                token_str = token_str.replace('\x00', '').strip()
-                met = best_metrics.get(token_str) or best_metrics.get(mint) or {}
+            for token_str in normalized_mints:
+                met = best_metrics.get(token_str) or {}
                 p = float(met.get('price_usd', 0.0))
                 lq = float(met.get('liquidity_usd', 0.0))
                 src = str(met.get('source', '')) if met else ''
                 prices[token_str] = p
                 liquidities[token_str] = lq
                 sources[token_str] = src
-                total_supply_norm = float(supplies.get(token_str, supplies.get(mint, 0.0)))
+                total_supply_norm = float(supplies.get(token_str, 0.0))
                 reserves_norm = float(reserves_map.get(token_str, 0.0))
                 circulating_supply = max(0.0, total_supply_norm - reserves_norm)
                 sup_val = circulating_supply
@@ -78,7 +72,7 @@ class TokenAggregationWorker:
                 market_caps[token_str] = mc
             logger.info(f'Computed prices and market caps for {len(prices)} tokens')
             normalized_initial = self.supply_calculator.get_last_initial_minted_normalized()
-            records = self._prepare_records(mints, supplies, prices, market_caps, liquidities, first_tx_dates, normalized_initial, sources, burned_amounts, metadata_map)
+            records = self._prepare_records(normalized_mints, supplies, prices, market_caps, liquidities, first_tx_dates, normalized_initial, sources, burned_amounts, metadata_map)
             if records:
                 logger.info(f'Would insert {len(records)} records into database')
                 self._print_records(records)
@@ -91,25 +85,24 @@ class TokenAggregationWorker:
 
     def _prepare_records(self, mints: List[str], supplies: Dict[str, int], prices: Dict[str, float], market_caps: Dict[str, float], liquidities: Dict[str, float], first_tx_dates: Dict[str, datetime], initial_minted: Dict[str, int], sources: Dict[str, str], burned_amounts: Dict[str, float], metadata_map: Dict) -> List[List[Any]]:
         records = []
-        for mint in mints:
-            token_str = mint.decode('utf-8', errors='ignore') if isinstance(mint, (bytes, bytearray)) else str(mint)
-            token_str = token_str.replace('\x00', '').strip()
-            supply = supplies.get(mint, supplies.get(token_str, 0.0))
-            price_usd = prices.get(mint, prices.get(token_str, 0.0))
-            market_cap_usd = market_caps.get(mint, market_caps.get(token_str, 0.0))
-            largest_lp_pool_usd = liquidities.get(mint, liquidities.get(token_str, 0.0))
-            first_tx_date = first_tx_dates.get(mint, first_tx_dates.get(token_str))
-            source = sources.get(token_str, sources.get(mint, ''))
-            burned = burned_amounts.get(token_str, burned_amounts.get(mint, 0))
+        # Mints arrive normalized, and every per-token map is keyed by them, so each value is a single lookup
+        for token_str in mints:
+            supply = supplies.get(token_str, 0.0)
+            price_usd = prices.get(token_str, 0.0)
+            market_cap_usd = market_caps.get(token_str, 0.0)
+            largest_lp_pool_usd = liquidities.get(token_str, 0.0)
+            first_tx_date = first_tx_dates.get(token_str)
+            source = sources.get(token_str, '')
+            burned = burned_amounts.get(token_str, 0)
 
             # Get metadata (symbol, name, uri)
-            metadata = metadata_map.get(token_str, metadata_map.get(mint, (None, None, None)))
+            metadata = metadata_map.get(token_str, (None, None, None))
             symbol = metadata[0] if metadata and len(metadata) > 0 else None
             name = metadata[1] if metadata and len(metadata) > 1 else None
             uri = metadata[2] if metadata and len(metadata) > 2 else None
 
             if first_tx_date is None:
-                logger.warning(f'Skipping token {mint[:8]}... - no first transaction date')
+                logger.warning(f'Skipping token {token_str[:8]}... - no first transaction date')
                 continue
             record = [token_str, 'solana', symbol, price_usd, market_cap_usd, supply, burned, largest_lp_pool_usd, first_tx_date, source, name, uri]
             records.append(record)
@@ -125,10 +118,7 @@ class TokenAggregationWorker:
         print(header)
         print('-' * 200)
         for record in records:
-            addr = record[0]
-            if isinstance(addr, (bytes, bytearray)):
-                addr = addr.decode('utf-8', errors='ignore').replace('\x00', '').strip()
-            token_address = addr
+            token_address = record[0]
             blockchain = record[1]
             symbol = record[2] if record[2] else 'N/A'
             price_usd = f'${record[3]:.12f}' if record[3] > 0 else '$0.000000000000'
@@ -156,5 +146,22 @@ def main():
     except Exception as e:
         logger.error(f'Error processing wallets: {e}', exc_info=True)
         raise
+    finally:
+        worker.metadata_fetcher.close()
+        worker.decimals_resolver.close()
+
+def migrate():
+    # One-time schema migrations on solana.swaps (run.py --migrate); the candidate pool query
+    # computes the new columns itself until they exist
+    logger.info('Applying ClickHouse schema migrations')
+    db_client = get_db_client()
+    try:
+        db_client.create_swap_token_indexes()
+        liquidity_analyzer = LiquidityAnalyzer(db_client)
+        liquidity_analyzer.create_canonical_source_column()
+        liquidity_analyzer.create_reference_coin_flag()
+        logger.info('Migrations applied')
+    finally:
+        db_client.close()
 if __name__ == '__main__':
     main()
\ No newline at end of file
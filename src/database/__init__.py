@@ -1,2 +1,2 @@
-from .db import ClickHouseClient, get_db_client
-__all__ = ['ClickHouseClient', 'get_db_client']
\ No newline at end of file
+from .db import AGGREGATION_SETTINGS, ClickHouseClient, get_db_client
+__all__ = ['AGGREGATION_SETTINGS', 'ClickHouseClient', 'get_db_client']
\ No newline at end of file
@@ -1,25 +1,43 @@
 import logging
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Sequence
 from uuid import uuid4
 import clickhouse_connect
+from clickhouse_connect.driver import httputil
 from ..config import Config
 logger = logging.getLogger(__name__)
 
+# Return FixedString columns (token addresses) as str with NUL padding stripped by the driver
+QUERY_FORMATS = {'FixedString': 'string'}
+# Per-query settings for GROUP BY mint / DISTINCT mint aggregations over tables ordered by mint:
+# finalize groups while reading in key order instead of merging full hash tables at the end
+AGGREGATION_SETTINGS = {'optimize_aggregation_in_order': 1, 'group_by_two_level_threshold': 10000, 'group_by_two_level_threshold_bytes': 50000000}
+
 class ClickHouseClient:
 
     def __init__(self):
         self.client = None
+        self._column_cache: Dict[tuple, bool] = {}
+        # One keep-alive HTTP pool for the life of the worker, sized for concurrent batch queries
+        # and kept across reconnects so a retry does not start from cold connections
+        self._pool_mgr = httputil.get_pool_manager(maxsize=Config.CLICKHOUSE_POOL_SIZE, num_pools=2)
         self._connect()
 
     def _connect(self):
+        if self.client:
+            self.client.close()
         try:
-            self.client = clickhouse_connect.get_client(host=Config.CLICKHOUSE_HOST, port=Config.CLICKHOUSE_PORT, username=Config.CLICKHOUSE_USER, password=Config.CLICKHOUSE_PASSWORD, database=Config.CLICKHOUSE_DATABASE)
+            self.client = clickhouse_connect.get_client(host=Config.CLICKHOUSE_HOST, port=Config.CLICKHOUSE_PORT, username=Config.CLICKHOUSE_USER, password=Config.CLICKHOUSE_PASSWORD, database=Config.CLICKHOUSE_DATABASE, pool_mgr=self._pool_mgr)
             logger.info(f'Connected to ClickHouse at {Config.CLICKHOUSE_HOST}:{Config.CLICKHOUSE_PORT}')
         except Exception as e:
             logger.error(f'Failed to connect to ClickHouse: {e}')
             raise
 
+    @staticmethod
+    def _is_session_locked(error: Exception) -> bool:
+        msg = str(error)
+        return 'SESSION_IS_LOCKED' in msg or 'code: 373' in msg
+
     def _log_query(self, query: str, parameters: Optional[Dict[str, Any]]=None):
         try:
             q = (query or '').strip()
@@ -33,7 +51,7 @@ class ClickHouseClient:
         except Exception as log_err:
             logger.debug(f'Failed to log SQL query: {log_err}')
 
-    def execute_query(self, query: str, parameters: Optional[Dict[str, Any]]=None) -> List[tuple]:
+    def execute_query(self, query: str, parameters: Optional[Dict[str, Any]]=None, settings: Optional[Dict[str, Any]]=None) -> List[tuple]:
         attempts = 2
         for attempt in range(attempts):
             try:
@@ -41,13 +59,14 @@ class ClickHouseClient:
                 logger.info('Executing query...')
 
                 # Increase timeout for large aggregation queries
-                settings = {
+                query_settings = {
                     'session_id': str(uuid4()),
                     'session_timeout': 300,  # 5 minutes
-                    'max_execution_time': 300  # 5 minutes query execution
+                    'max_execution_time': 300,  # 5 minutes query execution
+                    **(settings or {})
                 }
 
-                result = self.client.query(query, parameters=parameters or {}, settings=settings)
+                result = self.client.query(query, parameters=parameters or {}, settings=query_settings, query_formats=QUERY_FORMATS)
                 rows = result.result_rows
 
                 logger.info(f'Query completed successfully. Returned {len(rows)} rows')
@@ -58,8 +77,7 @@ class ClickHouseClient:
 
                 return rows
             except Exception as e:
-                msg = str(e)
-                if ('SESSION_IS_LOCKED' in msg or 'code: 373' in msg) and attempt < attempts - 1:
+                if self._is_session_locked(e) and attempt < attempts - 1:
                     logger.warning('Session locked, reconnecting and retrying query...')
                     self._connect()
                     continue
@@ -67,40 +85,38 @@ class ClickHouseClient:
                 logger.error(f'Query: {query}')
                 raise
 
-    def execute_query_dict(self, query: str, parameters: Optional[Dict[str, Any]]=None) -> List[Dict[str, Any]]:
+    def execute_query_column_stream(self, query: str, parameters: Optional[Dict[str, Any]]=None, settings: Optional[Dict[str, Any]]=None) -> Iterator[Sequence[Sequence]]:
         attempts = 2
         for attempt in range(attempts):
+            self._log_query(query, parameters)
+            logger.info('Executing query (column stream)...')
+
+            # Increase timeout for large aggregation queries
+            query_settings = {
+                'session_id': str(uuid4()),
+                'session_timeout': 300,  # 5 minutes
+                'max_execution_time': 300,  # 5 minutes query execution
+                **(settings or {})
+            }
+
+            row_count = 0
             try:
-                self._log_query(query, parameters)
-                logger.info('Executing query (dict)...')
-
-                # Increase timeout for large aggregation queries
-                settings = {
-                    'session_id': str(uuid4()),
-                    'session_timeout': 300,  # 5 minutes
-                    'max_execution_time': 300  # 5 minutes query execution
-                }
-
-                result = self.client.query(query, parameters=parameters or {}, settings=settings)
-                column_names = result.column_names
-                dict_rows = [dict(zip(column_names, row)) for row in result.result_rows]
-
-                logger.info(f'Query completed successfully. Returned {len(dict_rows)} dict rows')
-                if dict_rows and len(dict_rows) <= 5:
-                    logger.info(f'Rows: {dict_rows}')
-                elif dict_rows:
-                    logger.info(f'First 3 rows: {dict_rows[:3]}')
-
-                return dict_rows
+                with self.client.query_column_block_stream(query, parameters=parameters or {}, settings=query_settings, query_formats=QUERY_FORMATS) as stream:
+                    for block in stream:
+                        row_count += len(block[0]) if block else 0
+                        yield block
             except Exception as e:
-                msg = str(e)
-                if ('SESSION_IS_LOCKED' in msg or 'code: 373' in msg) and attempt < attempts - 1:
-                    logger.warning('Session locked, reconnecting and retrying query (dict)...')
+                # A locked session fails before any block arrives; once rows were yielded a retry
+                # would hand the caller duplicates, so only an untouched stream is retried
+                if self._is_session_locked(e) and row_count == 0 and attempt < attempts - 1:
+                    logger.warning('Session locked, reconnecting and retrying query (column stream)...')
                     self._connect()
                     continue
-                logger.error(f'Query execution failed: {e}', exc_info=True)
+                logger.error(f'Query stream failed after {row_count} rows: {e}', exc_info=True)
                 logger.error(f'Query: {query}')
                 raise
+            logger.info(f'Query stream completed successfully. Returned {row_count} rows')
+            return
 
     def execute_batch_insert(self, table: str, data: List[List[Any]], column_names: List[str]):
         try:
@@ -115,33 +131,53 @@ class ClickHouseClient:
             logger.error(f'Table: {table}, Rows: {len(data)}')
             raise
 
-    def create_token_metrics_table(self):
-        query = "\n        CREATE TABLE IF NOT EXISTS solana.token_metrics (\n            token_address FixedString(48),\n            blockchain String,\n            symbol Nullable(String),\n            name Nullable(String),\n            price_usd Float64,\n            market_cap_usd Float64,\n            supply UInt64,\n            largest_lp_pool_usd Float64,\n            first_tx_date DateTime('UTC')\n        )\n        ENGINE = MergeTree()\n        ORDER BY token_address\n        "
+    def execute_command(self, query: str, parameters: Optional[Dict[str, Any]]=None):
         attempts = 2
         for attempt in range(attempts):
             try:
-                self._log_query(query)
-                settings = {
-                    'session_id': str(uuid4()),
-                    'session_timeout': 300,  # 5 minutes
-                    'max_execution_time': 300
-                }
-                self.client.command(query)
-                logger.info('token_metrics table created or already exists')
+                self._log_query(query, parameters)
+                self.client.command(query, parameters=parameters or None)
                 return
             except Exception as e:
-                msg = str(e)
-                if ('SESSION_IS_LOCKED' in msg or 'code: 373' in msg) and attempt < attempts - 1:
+                if self._is_session_locked(e) and attempt < attempts - 1:
                     logger.warning('Session locked on command, reconnecting and retrying...')
                     self._connect()
                     continue
-                logger.error(f'Failed to create token_metrics table: {e}', exc_info=True)
+                logger.error(f'Command execution failed: {e}', exc_info=True)
+                logger.error(f'Command: {query}')
                 raise
 
+    def has_column(self, table: str, column: str) -> bool:
+        key = (table, column)
+        if key not in self._column_cache:
+            database, _, table_name = table.rpartition('.')
+            query = 'SELECT count() FROM system.columns WHERE database = {database:String} AND table = {table:String} AND name = {column:String}'
+            try:
+                rows = self.execute_query(query, parameters={'database': database or Config.CLICKHOUSE_DATABASE, 'table': table_name, 'column': column})
+                self._column_cache[key] = bool(rows and rows[0][0])
+            except Exception as e:
+                logger.warning(f'Could not check for column {table}.{column}: {e}')
+                self._column_cache[key] = False
+        return self._column_cache[key]
+
+    def create_token_metrics_table(self):
+        query = "\n        CREATE TABLE IF NOT EXISTS solana.token_metrics (\n            token_address FixedString(48),\n            blockchain String,\n            symbol Nullable(String),\n            name Nullable(String),\n            price_usd Float64,\n            market_cap_usd Float64,\n            supply UInt64,\n            largest_lp_pool_usd Float64,\n            first_tx_date DateTime('UTC')\n        )\n        ENGINE = MergeTree()\n        ORDER BY token_address\n        "
+        self.execute_command(query)
+        logger.info('token_metrics table created or already exists')
+
+    def create_swap_token_indexes(self):
+        # Bloom filter skip indexes let `base_coin IN ...` / `quote_coin IN ...` lookups on
+        # solana.swaps (candidate pools, first swaps) skip granules that hold none of the tokens
+        for column in ('base_coin', 'quote_coin'):
+            self.execute_command(f'ALTER TABLE solana.swaps ADD INDEX IF NOT EXISTS idx_{column}_bloom {column} TYPE bloom_filter(0.01) GRANULARITY 4')
+            self.execute_command(f'ALTER TABLE solana.swaps MATERIALIZE INDEX idx_{column}_bloom')
+        logger.info('base_coin/quote_coin bloom filter indexes materialized on solana.swaps')
+
     def close(self):
         if self.client:
             self.client.close()
             logger.info('ClickHouse connection closed')
+        self._pool_mgr.clear()
 _db_client = None
 
 def get_db_client() -> ClickHouseClient:
@@ -1,7 +1,13 @@
 import logging
-from typing import Dict, List
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 import requests
 from ..config import Config
+from .rpc_session import create_rpc_session, json_dumps, json_loads
+from .token_utils import normalize_token
 logger = logging.getLogger(__name__)
 
 class DecimalsResolver:
@@ -11,76 +17,140 @@ class DecimalsResolver:
         if not self.rpc_url:
             raise ValueError('SOLANA_HTTP_RPC_URL is not set in the environment.')
         self.decimals_cache: Dict[str, int] = {'So11111111111111111111111111111111111111112': 9, 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v': 6, 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB': 6}
+        self._cache_db = self._open_cache_db(Config.DECIMALS_CACHE_PATH)
+        self.session = create_rpc_session()
+        self._executor = ThreadPoolExecutor(max_workers=Config.RPC_MAX_CONCURRENCY, thread_name_prefix='decimals-rpc')
 
     def resolve_decimals_batch(self, token_addresses: List[str]) -> Dict[str, int]:
         if not token_addresses:
             return {}
         logger.info(f'Resolving decimals for {len(token_addresses)} tokens via RPC...')
-        normalized: List[str] = []
-        for addr in token_addresses:
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip()
-            if s and s not in self.decimals_cache:
-                normalized.append(s)
+        # Normalize once; the same keys feed the RPC lookups and the result below
+        keys = [normalize_token(addr) for addr in token_addresses]
+        decimals_cache = self.decimals_cache
+        normalized: List[str] = [s for s in dict.fromkeys(keys) if s and s not in decimals_cache]
         batch_size = 500
-        for i in range(0, len(normalized), batch_size):
-            batch = normalized[i:i + batch_size]
-
-            # Create mapping from id to mint address
-            id_to_mint = {}
-            payload = []
-            for idx, mint in enumerate(batch):
-                request_id = idx + 1
-                id_to_mint[request_id] = mint
-                payload.append({
-                    'jsonrpc': '2.0',
-                    'id': request_id,
-                    'method': 'getAccountInfo',
-                    'params': [mint, {'encoding': 'jsonParsed'}]
-                })
-
-            try:
-                resp = requests.post(self.rpc_url, json=payload, timeout=30)
-                resp.raise_for_status()
-                results = resp.json()
-
-                # Handle single response wrapped in dict
-                if isinstance(results, dict) and 'result' in results:
-                    results = [results]
-
-                # Match responses by 'id' field (responses may be out of order)
-                for item in results:
-                    response_id = item.get('id')
-                    if response_id is None or response_id not in id_to_mint:
-                        logger.debug(f'Received response with unexpected id: {response_id}')
-                        continue
-
-                    mint = id_to_mint[response_id]
-                    decimals, account_exists = self._parse_rpc_response(item)
-
-                    if decimals is not None:
-                        self.decimals_cache[mint] = int(decimals)
-                        logger.debug(f'Resolved decimals for {mint[:8]}...: {decimals}')
-                    elif not account_exists:
-                        # Account doesn't exist on chain - this is normal, use default
-                        logger.debug(f'Account does not exist for {mint[:8]}..., defaulting to 6')
-                        self.decimals_cache.setdefault(mint, 6)
-                    else:
-                        # Account exists but failed to parse - this is unusual
-                        logger.warning(f'Could not parse decimals for {mint}, defaulting to 6')
-                        self.decimals_cache.setdefault(mint, 6)
-            except requests.exceptions.RequestException as e:
-                logger.error(f'RPC request failed: {e}')
-                for mint in batch:
-                    self.decimals_cache.setdefault(mint, 6)
-        result = {}
-        for addr in token_addresses:
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip()
-            result[s] = self.decimals_cache.get(s, 6)
+        # Decimals persisted by earlier runs are loaded first, so only new mints go to RPC
+        if normalized and self._cache_db is not None:
+            for i in range(0, len(normalized), batch_size):
+                self._load_cached_decimals(normalized[i:i + batch_size])
+            normalized = [s for s in normalized if s not in self.decimals_cache]
+        # Batches are independent and latency-bound; post them concurrently over the pooled session and
+        # merge each batch's answers here, so the cache and the SQLite writes stay on this thread
+        batches = [normalized[i:i + batch_size] for i in range(0, len(normalized), batch_size)]
+        for batch_rows in self._executor.map(self._fetch_decimals_batch, batches):
+            resolved_rows = []
+            for mint, decimals, found in batch_rows:
+                if found:
+                    self.decimals_cache[mint] = decimals
+                else:
+                    self.decimals_cache.setdefault(mint, decimals)
+                # found is None when the request itself failed; that is not an answer worth persisting
+                if found is not None:
+                    resolved_rows.append((mint, decimals, found))
+            self._store_cached_decimals(resolved_rows)
+        result = {s: decimals_cache.get(s, 6) for s in keys}
         logger.info(f'Finished resolving decimals. Total cached: {len(self.decimals_cache)}')
         return result
 
+    def _fetch_decimals_batch(self, batch: List[str]) -> List[tuple]:
+        # Returns (mint, decimals, found) rows: found is 1 for parsed decimals, 0 when the account is
+        # missing or unparsable (defaulting to 6) and None when the RPC request failed
+
+        # Request ids are the 1-based positions in the batch, so a response id maps straight back to its mint
+        payload = [{
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'method': 'getAccountInfo',
+            'params': [mint, {'encoding': 'jsonParsed'}]
+        } for request_id, mint in enumerate(batch, 1)]
+        batch_len = len(batch)
+
+        rows = []
+        try:
+            resp = self.session.post(self.rpc_url, data=json_dumps(payload), headers={'Content-Type': 'application/json'}, timeout=30)
+            resp.raise_for_status()
+            results = json_loads(resp.content)
+
+            # Handle single response wrapped in dict
+            if isinstance(results, dict) and 'result' in results:
+                results = [results]
+
+            # Match responses by 'id' field (responses may be out of order)
+            for item in results:
+                response_id = item.get('id')
+                if not isinstance(response_id, int) or not 1 <= response_id <= batch_len:
+                    logger.debug('Received response with unexpected id: %s', response_id)
+                    continue
+
+                mint = batch[response_id - 1]
+                decimals, account_exists = self._parse_rpc_response(item)
+
+                if decimals is not None:
+                    rows.append((mint, int(decimals), 1))
+                    logger.debug('Resolved decimals for %s...: %s', mint[:8], decimals)
+                elif not account_exists:
+                    # Account doesn't exist on chain - this is normal, use default
+                    logger.debug('Account does not exist for %s..., defaulting to 6', mint[:8])
+                    rows.append((mint, 6, 0))
+                else:
+                    # Account exists but failed to parse - this is unusual
+                    logger.warning(f'Could not parse decimals for {mint}, defaulting to 6')
+                    rows.append((mint, 6, 0))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # ValueError covers an undecodable body, which resp.json() used to raise as a RequestException
+            logger.error(f'RPC request failed: {e}')
+            rows.extend((mint, 6, None) for mint in batch)
+        return rows
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        if self._cache_db is not None:
+            self._cache_db.close()
+            self._cache_db = None
+
+    def _open_cache_db(self, path: str) -> Optional[sqlite3.Connection]:
+        # Decimals never change for a mint, so resolved values are kept across runs; mints the RPC
+        # could not resolve are stored as not found and retried once DECIMALS_NOT_FOUND_TTL expires
+        if not path:
+            return None
+        try:
+            # The default lives under data/, which docker-compose mounts so the cache survives restarts
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS decimals (mint TEXT PRIMARY KEY, decimals INTEGER NOT NULL, found INTEGER NOT NULL, updated_at REAL NOT NULL)')
+            conn.commit()
+            logger.info(f'Using decimals cache at {path}')
+            return conn
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f'Could not open decimals cache at {path}, continuing without it: {e}')
+            return None
+
+    def _load_cached_decimals(self, mints: List[str]):
+        query = f"SELECT mint, decimals FROM decimals WHERE mint IN ({', '.join('?' * len(mints))}) AND (found = 1 OR updated_at >= ?)"
+        try:
+            rows = self._cache_db.execute(query, [*mints, time.time() - Config.DECIMALS_NOT_FOUND_TTL]).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f'Failed to read decimals cache: {e}')
+            return
+        self.decimals_cache.update(rows)
+        logger.info(f'Loaded decimals for {len(rows)}/{len(mints)} tokens from cache')
+
+    def _store_cached_decimals(self, rows: List[tuple]):
+        if not rows or self._cache_db is None:
+            return
+        now = time.time()
+        try:
+            with self._cache_db:
+                self._cache_db.executemany('INSERT OR REPLACE INTO decimals (mint, decimals, found, updated_at) VALUES (?, ?, ?, ?)', [(mint, decimals, found, now) for mint, decimals, found in rows])
+        except sqlite3.Error as e:
+            logger.warning(f'Failed to write decimals cache: {e}')
+
     def _parse_rpc_response(self, item: dict) -> tuple[int | None, bool]:
         """
         Parse RPC response for decimals.
@@ -99,4 +169,4 @@ class DecimalsResolver:
             decimals = value['data']['parsed']['info']['decimals']
             return (decimals, True)
         except Exception:
-            return (None, True)  # Exists but failed to parse
\ No newline at end of file
+            return (None, True)  # Exists but failed to parse
@@ -2,6 +2,7 @@ import logging
 from datetime import datetime
 from typing import Dict, Optional
 from ..database import ClickHouseClient
+from .token_utils import normalize_tokens
 logger = logging.getLogger(__name__)
 
 class FirstTxFinder:
@@ -15,10 +16,10 @@ class FirstTxFinder:
             first_swap = self._get_first_swap_date(token_address)
             dates = [d for d in [first_mint, first_swap] if d is not None]
             if not dates:
-                logger.debug(f'No transactions found for token {token_address[:8]}...')
+                logger.debug('No transactions found for token %s...', token_address[:8])
                 return None
             earliest = min(dates)
-            logger.debug(f'Token {token_address[:8]}... first tx: {earliest}')
+            logger.debug('Token %s... first tx: %s', token_address[:8], earliest)
             return earliest
         except Exception as e:
             logger.error(f'Failed to find first tx date for {token_address}: {e}')
@@ -28,14 +29,18 @@ class FirstTxFinder:
         if not token_addresses:
             return {}
         logger.info(f'Finding first tx dates for {len(token_addresses)} tokens (batch mode)')
-        first_mints = self._get_first_mints_batch(token_addresses)
-        first_swaps = self._get_first_swaps_batch(token_addresses)
-        first_dates: Dict[str, Optional[datetime]] = {}
-        for token in token_addresses:
-            mint_date = first_mints.get(token)
-            swap_date = first_swaps.get(token)
-            dates = [d for d in [mint_date, swap_date] if d is not None]
-            first_dates[token] = min(dates) if dates else None
+        # Key results by the normalized address, like the other batch processors
+        normalized = normalize_tokens(token_addresses)
+        first_mints = self._get_first_mints_batch(normalized)
+        first_swaps = self._get_first_swaps_batch(normalized)
+        # Merge the two sparse maps in place: start from the mint dates and only visit tokens that have
+        # a swap, instead of building a candidate list per token
+        first_dates: Dict[str, Optional[datetime]] = dict.fromkeys(normalized)
+        first_dates.update(first_mints)
+        for token, swap_date in first_swaps.items():
+            mint_date = first_dates.get(token)
+            if mint_date is None or swap_date < mint_date:
+                first_dates[token] = swap_date
         logger.info(f'Found first tx dates for {len(first_dates)} tokens')
         return first_dates
 
@@ -61,44 +66,32 @@ class FirstTxFinder:
             logger.error(f'Failed to get first swap date for {token_address}: {e}')
             return None
 
-    def _get_first_mints_batch(self, token_addresses: list) -> Dict[str, datetime]:
-        if not token_addresses:
+    def _get_first_mints_batch(self, normalized: list) -> Dict[str, datetime]:
+        # Takes addresses already normalized by find_first_tx_dates_batch
+        if not normalized:
             return {}
-        normalized = []
-        for addr in token_addresses:
-            if addr is None:
-                continue
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip().replace("'", "''")
-            if s:
-                normalized.append(f"'{s}'")
-        placeholders = ','.join(normalized) if normalized else "''"
-        query = f'\n        SELECT mint, MIN(block_time) as first_mint\n        FROM solana.mints\n        WHERE mint IN ({placeholders})\n        GROUP BY mint\n        '
-        logger.info('Executing first mint aggregation for provided tokens (%d)', len(token_addresses))
+        query = '\n        SELECT mint, MIN(block_time) as first_mint\n        FROM solana.mints\n        WHERE mint IN {tokens:Array(String)}\n        GROUP BY mint\n        '
+        logger.info('Executing first mint aggregation for provided tokens (%d)', len(normalized))
         try:
-            result = self.db_client.execute_query(query)
-            return {row[0]: row[1] for row in result if row[1]}
+            first_dates: Dict[str, datetime] = {}
+            for tokens, dates in self.db_client.execute_query_column_stream(query, parameters={'tokens': normalized}):
+                first_dates.update((token, date) for token, date in zip(tokens, dates) if date)
+            return first_dates
         except Exception as e:
             logger.error(f'Failed to get first mints (batch): {e}')
             return {}
 
-    def _get_first_swaps_batch(self, token_addresses: list) -> Dict[str, datetime]:
-        if not token_addresses:
+    def _get_first_swaps_batch(self, normalized: list) -> Dict[str, datetime]:
+        # Takes addresses already normalized by find_first_tx_dates_batch
+        if not normalized:
             return {}
-        normalized = []
-        for addr in token_addresses:
-            if addr is None:
-                continue
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip().replace("'", "''")
-            if s:
-                normalized.append(f"'{s}'")
-        placeholders = ','.join(normalized) if normalized else "''"
-        query = f'\n        SELECT\n            token,\n            MIN(block_time) as first_swap\n        FROM (\n            SELECT base_coin as token, block_time\n            FROM solana.swaps\n            WHERE base_coin IN ({placeholders})\n            UNION ALL\n            SELECT quote_coin as token, block_time\n            FROM solana.swaps\n            WHERE quote_coin IN ({placeholders})\n        )\n        GROUP BY token\n        '
-        logger.info('Executing first swap aggregation for provided tokens (%d)', len(token_addresses))
+        query = '\n        WITH {tokens:Array(String)} AS chunk_tokens\n        SELECT\n            token,\n            MIN(first_seen) as first_swap\n        FROM (\n            SELECT base_coin as token, MIN(block_time) as first_seen\n            FROM solana.swaps\n            WHERE base_coin IN chunk_tokens\n            GROUP BY base_coin\n            UNION ALL\n            SELECT quote_coin as token, MIN(block_time) as first_seen\n            FROM solana.swaps\n            WHERE quote_coin IN chunk_tokens\n            GROUP BY quote_coin\n        )\n        GROUP BY token\n        '
+        logger.info('Executing first swap aggregation for provided tokens (%d)', len(normalized))
         try:
-            result = self.db_client.execute_query(query)
-            return {row[0]: row[1] for row in result if row[1]}
+            first_dates: Dict[str, datetime] = {}
+            for tokens, dates in self.db_client.execute_query_column_stream(query, parameters={'tokens': normalized}):
+                first_dates.update((token, date) for token, date in zip(tokens, dates) if date)
+            return first_dates
         except Exception as e:
             logger.error(f'Failed to get first swaps (batch): {e}')
             return {}
\ No newline at end of file
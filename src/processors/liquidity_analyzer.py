@@ -1,124 +1,163 @@
 import logging
-import json
-from typing import Dict, Optional
-from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
 from ..database import ClickHouseClient
+from .token_utils import POW10F, normalize_tokens
 
 logger = logging.getLogger(__name__)
 
 STABLECOINS = {'USDC': 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v', 'USDT': 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB'}
+STABLECOIN_MINTS = frozenset(STABLECOINS.values())
+STABLECOIN_USD = dict.fromkeys(STABLECOIN_MINTS, 1.0)
 SOL_ADDRESS = 'So11111111111111111111111111111111111111112'
 SOL_PRICE_USD = 190.0
+REFERENCE_COINS = [SOL_ADDRESS, STABLECOINS['USDC'], STABLECOINS['USDT']]
+# Literal form for column definitions, where query parameters cannot be bound
+REFERENCE_COINS_SQL = '[' + ', '.join(f"'{coin}'" for coin in REFERENCE_COINS) + ']'
+# Strip aggregator route prefixes so routed swaps group with the underlying pool
+CANONICAL_SOURCE_SQL = "multiIf(startsWith(source, 'jupiter6_') OR startsWith(source, 'jupiter4_'), substring(source, 10), startsWith(source, 'raydium_route_'), substring(source, 15), source)"
 
 class LiquidityAnalyzer:
 
     def __init__(self, db_client: ClickHouseClient):
         self.db_client = db_client
         self.sol_price_usd = SOL_PRICE_USD
+        # USD value of one unit of each reference coin; rebuilt only when the SOL price is set
+        self._usd_per_unit: Dict[str, float] = {SOL_ADDRESS: SOL_PRICE_USD, **STABLECOIN_USD}
 
     def get_best_pool_metrics_batch(self, token_addresses: list, decimals_map: Dict[str, int]) -> Dict[str, dict]:
+        best_metrics, _ = self.analyze_pools_batch(token_addresses, decimals_map)
+        return best_metrics
+
+    def get_token_reserves_map(self, token_addresses: list, decimals_map: Dict[str, int]) -> Dict[str, float]:
+        _, reserves = self.analyze_pools_batch(token_addresses, decimals_map)
+        return reserves
+
+    def analyze_pools_batch(self, token_addresses: list, decimals_map: Dict[str, int]) -> Tuple[Dict[str, dict], Dict[str, float]]:
         if not token_addresses:
-            return {}
-        normalized_tokens = []
-        for token in token_addresses:
-            t = token.decode('utf-8', errors='ignore') if isinstance(token, (bytes, bytearray)) else str(token)
-            t = t.replace('\x00', '').strip()
-            if t:
-                normalized_tokens.append(t)
-        candidate_pools_raw = self._get_all_candidate_pools_batch(normalized_tokens) or []
-        pools_by_token: Dict[str, Dict[str, list]] = defaultdict(lambda: {'priority': [], 'bonding': []})
-        for row in candidate_pools_raw:
-            source, base_coin, quote_coin, base_balance_raw, quote_balance_raw = row
-            source, base_coin, quote_coin = map(lambda x: x.decode('utf-8', 'ignore').strip('\x00') if isinstance(x, bytes) else str(x), [source, base_coin, quote_coin])
-            base_decimals = decimals_map.get(base_coin, 9 if base_coin == SOL_ADDRESS else 6)
-            quote_decimals = decimals_map.get(quote_coin, 9 if quote_coin == SOL_ADDRESS else 6)
-            base_balance_norm = float(base_balance_raw) / 10 ** base_decimals
-            quote_balance_norm = float(quote_balance_raw) / 10 ** quote_decimals
-            liquidity_usd = 0.0
-            if base_coin == SOL_ADDRESS:
-                liquidity_usd = base_balance_norm * float(self.sol_price_usd) * 2.0
-            elif quote_coin == SOL_ADDRESS:
-                liquidity_usd = quote_balance_norm * float(self.sol_price_usd) * 2.0
-            elif base_coin in STABLECOINS.values():
-                liquidity_usd = base_balance_norm * 2.0
-            elif quote_coin in STABLECOINS.values():
-                liquidity_usd = quote_balance_norm * 2.0
-            pool_data = {'source': source, 'base_coin': base_coin, 'quote_coin': quote_coin, 'base_balance_norm': base_balance_norm, 'quote_balance_norm': quote_balance_norm, 'liquidity_usd': liquidity_usd}
-            pool_category = 'bonding' if 'bondingcurve' in source.lower() else 'priority'
-            if base_coin in normalized_tokens:
-                pools_by_token[base_coin][pool_category].append(pool_data)
-            if quote_coin in normalized_tokens:
-                pools_by_token[quote_coin][pool_category].append(pool_data)
+            return {}, {}
+        normalized_tokens = normalize_tokens(token_addresses)
+        if not normalized_tokens:
+            return {}, {}
+        token_index = {t: i for i, t in enumerate(normalized_tokens)}
+        best_priority: List[Optional[tuple]] = [None] * len(normalized_tokens)
+        best_bonding: List[Optional[tuple]] = [None] * len(normalized_tokens)
+        reserve_totals = [0.0] * len(normalized_tokens)
+        usd_per_unit = self._usd_per_unit
+        reference_rates = (usd_per_unit[SOL_ADDRESS], 1.0)
+        coin_decimals = {SOL_ADDRESS: 9, **decimals_map}
+        token_scales = [1.0 / POW10F[int(coin_decimals.get(t, 6))] for t in normalized_tokens]
+        reference_scales = {coin: 1.0 / POW10F[int(coin_decimals.get(coin, 6))] for coin in usd_per_unit}
+        for candidate_columns in self._get_all_candidate_pools_batch(normalized_tokens):
+            for source, base_coin, quote_coin, base_balance_raw, quote_balance_raw, is_bonding, value_side, reference_code in zip(*candidate_columns):
+                base_idx = token_index.get(base_coin)
+                quote_idx = token_index.get(quote_coin)
+                base_balance_norm = float(base_balance_raw) * (token_scales[base_idx] if base_idx is not None else reference_scales.get(base_coin, 1e-6))
+                quote_balance_norm = float(quote_balance_raw) * (token_scales[quote_idx] if quote_idx is not None else reference_scales.get(quote_coin, 1e-6))
+                if base_idx is not None:
+                    reserve_totals[base_idx] += base_balance_norm
+                if quote_idx is not None:
+                    reserve_totals[quote_idx] += quote_balance_norm
+                # value_side: 0 values the pool from the base balance, 1 from the quote balance;
+                # reference_code: 0 for SOL, 1 for a stablecoin
+                liquidity_usd = (quote_balance_norm if value_side else base_balance_norm) * reference_rates[reference_code] * 2.0
+                pool_data = (liquidity_usd, source, base_coin, quote_coin, base_balance_norm, quote_balance_norm)
+                best = best_bonding if is_bonding else best_priority
+                if base_idx is not None:
+                    current = best[base_idx]
+                    if current is None or liquidity_usd > current[0]:
+                        best[base_idx] = pool_data
+                if quote_idx is not None:
+                    current = best[quote_idx]
+                    if current is None or liquidity_usd > current[0]:
+                        best[quote_idx] = pool_data
+        reserves: Dict[str, float] = {t: reserve_totals[token_index[t]] for t in normalized_tokens}
         final_metrics: Dict[str, dict] = {}
         for token in normalized_tokens:
-            token_pools = pools_by_token.get(token)
-            best_pool = None
-            if token_pools:
-                candidate_list = token_pools['priority'] if token_pools['priority'] else token_pools['bonding']
-                if candidate_list:
-                    best_pool = max(candidate_list, key=lambda p: p['liquidity_usd'])
-            if not best_pool:
+            idx = token_index[token]
+            best_pool = best_priority[idx] or best_bonding[idx]
+            if best_pool is None:
                 final_metrics[token] = {'source': '', 'liquidity_usd': 0.0, 'price_usd': 0.0}
                 continue
+            liquidity_usd, source, base_coin, quote_coin, base_balance_norm, quote_balance_norm = best_pool
             price_usd = 0.0
-            if best_pool['base_balance_norm'] > 0 and best_pool['quote_balance_norm'] > 0:
-                if token == best_pool['base_coin']:
-                    quote_val_usd = best_pool['quote_balance_norm'] * (float(self.sol_price_usd) if best_pool['quote_coin'] == SOL_ADDRESS else 1.0)
-                    price_usd = quote_val_usd / best_pool['base_balance_norm']
+            if base_balance_norm > 0 and quote_balance_norm > 0:
+                if token == base_coin:
+                    price_usd = quote_balance_norm * usd_per_unit.get(quote_coin, 1.0) / base_balance_norm
                 else:
-                    base_val_usd = best_pool['base_balance_norm'] * (float(self.sol_price_usd) if best_pool['base_coin'] == SOL_ADDRESS else 1.0)
-                    price_usd = base_val_usd / best_pool['quote_balance_norm']
-            final_metrics[token] = {'source': best_pool['source'], 'liquidity_usd': best_pool['liquidity_usd'], 'price_usd': price_usd}
-        return final_metrics
+                    price_usd = base_balance_norm * usd_per_unit.get(base_coin, 1.0) / quote_balance_norm
+            final_metrics[token] = {'source': source, 'liquidity_usd': liquidity_usd, 'price_usd': price_usd}
+        return final_metrics, reserves
 
-    def _get_all_candidate_pools_batch(self, token_addresses: list) -> list:
+    def _get_all_candidate_pools_batch(self, token_addresses: list) -> Iterator[list]:
         if not token_addresses:
-            return []
-        placeholders = ', '.join([f"'{t}'" for t in token_addresses])
-        usdc = STABLECOINS['USDC']
-        usdt = STABLECOINS['USDT']
-        query = f"\n        SELECT\n            CASE\n                WHEN source LIKE 'jupiter6_%' THEN substring(source, 10)\n                WHEN source LIKE 'jupiter4_%' THEN substring(source, 10)\n                WHEN source LIKE 'raydium_route_%' THEN substring(source, 15)\n                ELSE source\n            END AS canonical_source,\n            base_coin,\n            quote_coin,\n            argMax(base_pool_balance_after, block_time) AS last_base_balance,\n            argMax(quote_pool_balance_after, block_time) AS last_quote_balance\n        FROM solana.swaps\n        WHERE\n            (base_coin IN ({placeholders}) AND (quote_coin = '{SOL_ADDRESS}' OR quote_coin IN ('{usdc}','{usdt}')))\n            OR\n            (quote_coin IN ({placeholders}) AND (base_coin = '{SOL_ADDRESS}' OR base_coin IN ('{usdc}','{usdt}')))\n        GROUP BY canonical_source, base_coin, quote_coin\n        HAVING last_base_balance > 0 AND last_quote_balance > 0\n        "
+            return
+        # Prefer the materialized columns when the migrations have been applied
+        if self.db_client.has_column('solana.swaps', 'canonical_source'):
+            source_select = 'canonical_source'
+        else:
+            # Dictionary-encode the computed source like the materialized LowCardinality column, so the
+            # driver decodes each distinct source once per block and rows share the same str objects
+            source_select = f'toLowCardinality({CANONICAL_SOURCE_SQL}) AS canonical_source'
+        if self.db_client.has_column('solana.swaps', 'has_reference_coin'):
+            prewhere = 'PREWHERE has_reference_coin'
+        else:
+            prewhere = ''
+        # Chunk and reference membership are constant-set IN probes (one hash set each, built once
+        # per query); the reference flags are named once and shared by the filter and value_side.
+        # Both pool balances come from one argMax state, so they are always read from the same swap
+        query = f"""
+        WITH
+            {{tokens:Array(String)}} AS chunk_tokens,
+            {{reference_coins:Array(String)}} AS reference_coins,
+            base_coin IN reference_coins AS base_is_reference,
+            quote_coin IN reference_coins AS quote_is_reference,
+            argMax((base_pool_balance_after, quote_pool_balance_after), block_time) AS last_balances
+        SELECT
+            {source_select},
+            base_coin,
+            quote_coin,
+            last_balances.1 AS last_base_balance,
+            last_balances.2 AS last_quote_balance,
+            positionCaseInsensitive(canonical_source, 'bondingcurve') > 0 AS is_bonding,
+            NOT (base_is_reference AND quote_coin != {{sol:String}}) AS value_side,
+            if(value_side, quote_coin, base_coin) != {{sol:String}} AS reference_code
+        FROM solana.swaps
+        {prewhere}
+        WHERE
+            (quote_is_reference AND base_coin IN chunk_tokens)
+            OR
+            (base_is_reference AND quote_coin IN chunk_tokens)
+        GROUP BY canonical_source, base_coin, quote_coin
+        HAVING last_base_balance > 0 AND last_quote_balance > 0
+        """
+        pool_count = 0
         try:
-            result = self.db_client.execute_query(query) or []
-            logger.info(f'Received {len(result)} candidate pools from DB.')
-            return result
+            for block in self.db_client.execute_query_column_stream(query, parameters={'tokens': token_addresses, 'reference_coins': REFERENCE_COINS, 'sol': SOL_ADDRESS}):
+                if block:
+                    pool_count += len(block[0])
+                    yield block
         except Exception as e:
             logger.error(f'Failed to get candidate pools batch: {e}')
-            return []
+            return
+        logger.info(f'Received {pool_count} candidate pools from DB.')
 
-    def get_token_reserves_map(self, token_addresses: list, decimals_map: Dict[str, int]) -> Dict[str, float]:
-        if not token_addresses:
-            return {}
-        normalized_tokens = []
-        for token in token_addresses:
-            t = token.decode('utf-8', errors='ignore') if isinstance(token, (bytes, bytearray)) else str(token)
-            t = t.replace('\x00', '').strip()
-            if t:
-                normalized_tokens.append(t)
-        candidate_pools_raw = self._get_all_candidate_pools_batch(normalized_tokens) or []
-        reserves: Dict[str, float] = {t: 0.0 for t in normalized_tokens}
-        for row in candidate_pools_raw:
-            source, base_coin, quote_coin, base_balance_raw, quote_balance_raw = row
-            if isinstance(base_coin, (bytes, bytearray)):
-                base_coin = base_coin.decode('utf-8', errors='ignore').replace('\x00', '').strip()
-            if isinstance(quote_coin, (bytes, bytearray)):
-                quote_coin = quote_coin.decode('utf-8', errors='ignore').replace('\x00', '').strip()
-            base_decimals = int(decimals_map.get(base_coin, 9 if base_coin == SOL_ADDRESS else 6))
-            quote_decimals = int(decimals_map.get(quote_coin, 9 if quote_coin == SOL_ADDRESS else 6))
-            try:
-                base_balance_norm = float(base_balance_raw) / 10 ** base_decimals
-            except Exception:
-                base_balance_norm = float(int(base_balance_raw)) / 10 ** base_decimals
-            try:
-                quote_balance_norm = float(quote_balance_raw) / 10 ** quote_decimals
-            except Exception:
-                quote_balance_norm = float(int(quote_balance_raw)) / 10 ** quote_decimals
-            if base_coin in reserves:
-                reserves[base_coin] += base_balance_norm
-            if quote_coin in reserves:
-                reserves[quote_coin] += quote_balance_norm
-        return reserves
+    def create_canonical_source_column(self):
+        # One-time migration: store the canonicalized source on solana.swaps so candidate pool
+        # queries group on a LowCardinality column instead of evaluating the CASE per row
+        self.db_client.execute_command(f'ALTER TABLE solana.swaps ADD COLUMN IF NOT EXISTS canonical_source LowCardinality(String) MATERIALIZED {CANONICAL_SOURCE_SQL}')
+        self.db_client.execute_command('ALTER TABLE solana.swaps MATERIALIZE COLUMN canonical_source')
+        logger.info('canonical_source column materialized on solana.swaps')
+
+    def create_reference_coin_flag(self):
+        # One-time migration: flag swaps that touch SOL/USDC/USDT; the minmax index lets the
+        # candidate pool PREWHERE skip whole granules of token-to-token swaps
+        self.db_client.execute_command(f'ALTER TABLE solana.swaps ADD COLUMN IF NOT EXISTS has_reference_coin UInt8 MATERIALIZED (base_coin IN {REFERENCE_COINS_SQL}) OR (quote_coin IN {REFERENCE_COINS_SQL})')
+        self.db_client.execute_command('ALTER TABLE solana.swaps ADD INDEX IF NOT EXISTS idx_has_reference_coin has_reference_coin TYPE minmax GRANULARITY 4')
+        self.db_client.execute_command('ALTER TABLE solana.swaps MATERIALIZE COLUMN has_reference_coin')
+        self.db_client.execute_command('ALTER TABLE solana.swaps MATERIALIZE INDEX idx_has_reference_coin')
+        logger.info('has_reference_coin column and index materialized on solana.swaps')
 
     def set_sol_price(self, price: float):
         self.sol_price_usd = price
+        self._usd_per_unit = {SOL_ADDRESS: float(price), **STABLECOIN_USD}
         logger.debug(f'SOL price set to ${price:.2f}')
\ No newline at end of file
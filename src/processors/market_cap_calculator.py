@@ -8,7 +8,7 @@ class MarketCapCalculator:
     def calculate_market_cap(supply: int, price_usd: float) -> float:
         try:
             market_cap = supply * price_usd
-            logger.debug(f'Market cap: {supply} × ${price_usd:.6f} = ${market_cap:.2f}')
+            logger.debug('Market cap: %s × $%.6f = $%.2f', supply, price_usd, market_cap)
             return market_cap
         except Exception as e:
             logger.error(f'Failed to calculate market cap: {e}')
@@ -16,10 +16,8 @@ class MarketCapCalculator:
 
     @staticmethod
     def calculate_market_caps_batch(supplies: Dict[str, int], prices: Dict[str, float]) -> Dict[str, float]:
-        market_caps = {}
-        for token_address in supplies.keys():
-            supply = supplies.get(token_address, 0)
-            price = prices.get(token_address, 0.0)
-            market_caps[token_address] = supply * price
+        # One pass over the supply items with the price lookup bound once
+        get_price = prices.get
+        market_caps = {token_address: supply * get_price(token_address, 0.0) for token_address, supply in supplies.items()}
         logger.info(f'Calculated market caps for {len(market_caps)} tokens')
         return market_caps
\ No newline at end of file
@@ -1,15 +1,67 @@
 import logging
-import base58
+import functools
 import hashlib
 import struct
-import base64
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 import requests
 from ..config import Config
+from .rpc_session import create_rpc_session, json_dumps, json_loads
+from .token_utils import normalize_token
+
+try:
+    # Rust (PyO3) implementation with the same interface as the base58 package, used when installed
+    import based58 as _base58
+except ImportError:
+    import base58 as _base58
+
+try:
+    # SIMD base64 decoder with the stdlib interface, used when installed
+    import pybase64 as _base64
+except ImportError:
+    import base64 as _base64
 
 logger = logging.getLogger(__name__)
 
-METAPLEX_PROGRAM_ID = "metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s"
+METAPLEX_PROGRAM_ID = Config.METAPLEX_PROGRAM_ID
+METADATA_BATCH_SIZE = 100
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _mint_to_bytes(mint_address: str) -> bytes:
+    return _base58.b58decode(mint_address.encode('ascii'))
+
+
+# Invariant PDA derivation inputs, computed once at import
+_METADATA_SEED = b"metadata"
+_PROGRAM_ID_BYTES = _base58.b58decode(METAPLEX_PROGRAM_ID.encode('ascii'))
+_PDA_BUMP = bytes((255,))
+_PDA_SUFFIX = b"ProgramDerivedAddress"
+
+_ACCOUNT_INFO_OPTIONS = {'encoding': 'base64'}
+
+# Borsh string length prefix (u32 little-endian)
+_LEN_STRUCT = struct.Struct('<I')
+
+
+def _derive_metadata_pda(mint_address: str) -> bytes:
+    """
+    Derive the raw Metaplex metadata PDA for a mint address.
+
+    No on-curve check is performed, so the canonical bump 255 is always used
+    and the address is a single SHA-256 of the seeds, bump, program id and
+    PDA marker.
+
+    Args:
+        mint_address: Token mint address
+
+    Returns:
+        Raw 32-byte metadata PDA
+
+    Raises:
+        ValueError: If the mint is not valid base58
+    """
+    return hashlib.sha256(_METADATA_SEED + _PROGRAM_ID_BYTES + _mint_to_bytes(mint_address) + _PDA_BUMP + _PROGRAM_ID_BYTES + _PDA_SUFFIX).digest()
 
 
 class MetadataFetcher:
@@ -18,6 +70,10 @@ class MetadataFetcher:
         if not self.rpc_url:
             raise ValueError('SOLANA_HTTP_RPC_URL is not set in the environment.')
         self.metadata_cache: Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+        self.session = create_rpc_session()
+        # Long-lived worker pool: each task derives its batch's PDAs and then posts it, so derivation
+        # for one batch overlaps the in-flight RPC of the others
+        self._executor = ThreadPoolExecutor(max_workers=Config.RPC_MAX_CONCURRENCY, thread_name_prefix='metadata-rpc')
 
     def resolve_metadata_batch(self, token_addresses: List[str]) -> Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]]:
         """
@@ -34,23 +90,18 @@ class MetadataFetcher:
 
         logger.info(f'Resolving metadata for {len(token_addresses)} tokens via Metaplex...')
 
-        normalized: List[str] = []
-        for addr in token_addresses:
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip()
-            if s and s not in self.metadata_cache:
-                normalized.append(s)
+        # Normalize each input once; the same list drives the fetch and the result assembly
+        normalized = [normalize_token(addr) for addr in token_addresses]
 
-        batch_size = 100
-        for i in range(0, len(normalized), batch_size):
-            batch = normalized[i:i + batch_size]
-            self._fetch_metadata_batch(batch)
+        # Executor.map submits every batch up front, so the batches are built as a plain list
+        uncached = list(self._iter_uncached(normalized))
+        batches = [uncached[i:i + METADATA_BATCH_SIZE] for i in range(0, len(uncached), METADATA_BATCH_SIZE)]
+        # Batches are independent and latency-bound; overlap their round trips over the pooled session
+        list(self._executor.map(self._fetch_metadata_batch, batches))
 
         result = {}
         metadata_found = 0
-        for addr in token_addresses:
-            s = addr.decode('utf-8', errors='ignore') if isinstance(addr, (bytes, bytearray)) else str(addr)
-            s = s.replace('\x00', '').strip()
+        for s in normalized:
             metadata = self.metadata_cache.get(s, (None, None, None))
             result[s] = metadata
             if metadata and metadata[0] is not None:  # Has symbol
@@ -59,37 +110,44 @@ class MetadataFetcher:
         logger.info(f'Finished resolving metadata. Found metadata for {metadata_found}/{len(token_addresses)} tokens')
         return result
 
+    def _iter_uncached(self, normalized: List[str]) -> Iterator[str]:
+        """Yield each distinct non-empty mint that is not in the metadata cache yet."""
+        seen = set()
+        for mint in normalized:
+            if mint and mint not in seen and mint not in self.metadata_cache:
+                seen.add(mint)
+                yield mint
+
     def _fetch_metadata_batch(self, mint_addresses: List[str]):
         """Fetch metadata for a batch of mint addresses."""
         # Derive metadata PDAs for all mints
         metadata_accounts = []
-        for mint in mint_addresses:
-            metadata_pda = self._derive_metadata_pda(mint)
+        for mint, metadata_pda in zip(mint_addresses, map(self._derive_metadata_pda, mint_addresses)):
             if metadata_pda:
-                metadata_accounts.append((mint, metadata_pda))
+                metadata_accounts.append((mint, _base58.b58encode(metadata_pda).decode('ascii')))
             else:
                 # Many tokens don't have Metaplex metadata - this is expected
-                logger.debug(f'Could not derive metadata PDA for {mint}')
+                logger.debug('Could not derive metadata PDA for %s', mint)
                 self.metadata_cache[mint] = (None, None, None)
 
         if not metadata_accounts:
             return
 
-        # Build RPC batch request
+        # Build RPC batch request; the options object is shared since it serializes identically
         payload = [
             {
                 'jsonrpc': '2.0',
-                'id': idx + 1,
+                'id': request_id,
                 'method': 'getAccountInfo',
-                'params': [metadata_pda, {'encoding': 'base64'}]
+                'params': [metadata_pda, _ACCOUNT_INFO_OPTIONS]
             }
-            for idx, (mint, metadata_pda) in enumerate(metadata_accounts)
+            for request_id, (_, metadata_pda) in enumerate(metadata_accounts, start=1)
         ]
 
         try:
-            resp = requests.post(self.rpc_url, json=payload, timeout=60)
+            resp = self.session.post(self.rpc_url, data=json_dumps(payload), headers={'Content-Type': 'application/json'}, timeout=60)
             resp.raise_for_status()
-            results = resp.json()
+            results = json_loads(resp.content)
 
             # Handle single response wrapped in dict
             if isinstance(results, dict) and 'result' in results:
@@ -107,9 +165,9 @@ class MetadataFetcher:
 
                 if metadata and metadata[0]:  # Has symbol
                     found_count += 1
-                    logger.debug(f'Found metadata for {mint[:8]}...: symbol={metadata[0]}, name={metadata[1]}')
+                    logger.debug('Found metadata for %s...: symbol=%s, name=%s', mint[:8], metadata[0], metadata[1])
                 else:
-                    logger.debug(f'No metadata found for {mint[:8]}... at PDA {metadata_pda[:8]}...')
+                    logger.debug('No metadata found for %s... at PDA %s...', mint[:8], metadata_pda[:8])
 
             if found_count > 0:
                 logger.info(f'Successfully fetched metadata for {found_count}/{len(metadata_accounts)} tokens in this batch')
@@ -123,7 +181,11 @@ class MetadataFetcher:
             for mint, _ in metadata_accounts:
                 self.metadata_cache.setdefault(mint, (None, None, None))
 
-    def _derive_metadata_pda(self, mint_address: str) -> Optional[str]:
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _derive_metadata_pda(self, mint_address: str) -> Optional[bytes]:
         """
         Derive the Metaplex metadata PDA for a given mint address.
 
@@ -131,82 +193,14 @@ class MetadataFetcher:
             mint_address: Token mint address
 
         Returns:
-            Metadata PDA address or None if derivation fails
+            Raw 32-byte metadata PDA or None if derivation fails
         """
         try:
-            # Decode addresses from base58
-            program_id_bytes = base58.b58decode(METAPLEX_PROGRAM_ID)
-            mint_bytes = base58.b58decode(mint_address)
-
-            # Seeds for PDA derivation
-            seeds = [
-                b"metadata",
-                program_id_bytes,
-                mint_bytes
-            ]
-
-            # Find program address
-            pda, _ = self._find_program_address(seeds, program_id_bytes)
-            return base58.b58encode(pda).decode('utf-8')
-
+            return _derive_metadata_pda(mint_address)
         except Exception as e:
-            logger.debug(f'Failed to derive metadata PDA for {mint_address}: {e}')
+            logger.debug('Failed to derive metadata PDA for %s: %s', mint_address, e)
             return None
 
-    def _find_program_address(self, seeds: List[bytes], program_id: bytes) -> Tuple[bytes, int]:
-        """
-        Find a valid program derived address and its bump seed.
-
-        Args:
-            seeds: List of seed bytes
-            program_id: Program ID bytes
-
-        Returns:
-            Tuple of (PDA bytes, bump seed)
-        """
-        for bump in range(256, 0, -1):
-            try:
-                seeds_with_bump = seeds + [bytes([bump - 1])]
-                pda = self._create_program_address(seeds_with_bump, program_id)
-                return pda, bump - 1
-            except ValueError:
-                continue
-        raise ValueError("Unable to find a viable program address bump seed")
-
-    def _create_program_address(self, seeds: List[bytes], program_id: bytes) -> bytes:
-        """
-        Create a program address (PDA).
-
-        Args:
-            seeds: List of seed bytes
-            program_id: Program ID bytes
-
-        Returns:
-            PDA bytes
-
-        Raises:
-            ValueError: If the derived address is on the ed25519 curve
-        """
-        hasher = hashlib.sha256()
-        for seed in seeds:
-            hasher.update(seed)
-        hasher.update(program_id)
-        hasher.update(b"ProgramDerivedAddress")
-
-        pda = hasher.digest()
-
-        if self._is_on_curve(pda):
-            raise ValueError("Address is on curve")
-
-        return pda
-
-    def _is_on_curve(self, pubkey: bytes) -> bool:
-        """
-        Simplified check if a public key is on the ed25519 curve.
-        For PDA derivation, we just need to ensure it's not on curve.
-        """
-        return False
-
     def _parse_metadata_account(self, rpc_response: dict) -> Tuple[Optional[str], Optional[str], Optional[str]]:
         """
         Parse Metaplex metadata account data according to the Metaplex Token Metadata standard.
@@ -230,17 +224,17 @@ class MetadataFetcher:
 
             account_data = value.get('data')
             if not account_data or not isinstance(account_data, list) or len(account_data) < 1:
-                logger.debug(f'Invalid account data format: {type(account_data)}')
+                logger.debug('Invalid account data format: %s', type(account_data))
                 return (None, None, None)
 
             # Decode base64 data
             try:
-                data_bytes = base64.b64decode(account_data[0])
+                data_bytes = _base64.b64decode(account_data[0], validate=False)
             except Exception as e:
-                logger.debug(f'Failed to decode base64 data: {e}')
+                logger.debug('Failed to decode base64 data: %s', e)
                 return (None, None, None)
 
-            logger.debug(f'Decoded {len(data_bytes)} bytes of metadata')
+            logger.debug('Decoded %d bytes of metadata', len(data_bytes))
 
             # Metaplex metadata structure (fixed-size fields):
             # - key (1 byte)
@@ -251,37 +245,40 @@ class MetadataFetcher:
             # - uri (4 bytes length + 200 bytes fixed data)
 
             if len(data_bytes) < 65:
-                logger.debug(f'Data too short: {len(data_bytes)} bytes')
+                logger.debug('Data too short: %d bytes', len(data_bytes))
                 return (None, None, None)
 
             offset = 65  # Skip key (1) + update_authority (32) + mint (32)
 
+            # Zero-copy view: field reads below slice the view instead of copying bytes
+            data_view = memoryview(data_bytes)
+
             # Read name (4-byte length prefix + 32-byte fixed size)
-            name = self._read_string(data_bytes, offset)
+            name = self._read_string(data_view, offset)
             offset += 4 + 32  # Always increment by fixed size
 
             # Read symbol (4-byte length prefix + 10-byte fixed size)
-            symbol = self._read_string(data_bytes, offset)
+            symbol = self._read_string(data_view, offset)
             offset += 4 + 10  # Always increment by fixed size
 
             # Read URI (4-byte length prefix + 200-byte fixed size)
-            uri = self._read_string(data_bytes, offset)
+            uri = self._read_string(data_view, offset)
 
             if symbol or name or uri:
-                logger.debug(f'Parsed metadata: symbol="{symbol}", name="{name}", uri="{uri}"')
+                logger.debug('Parsed metadata: symbol="%s", name="%s", uri="%s"', symbol, name, uri)
 
             return (symbol, name, uri)
 
         except Exception as e:
-            logger.debug(f'Failed to parse metadata account: {e}', exc_info=True)
+            logger.debug('Failed to parse metadata account: %s', e, exc_info=True)
             return (None, None, None)
 
-    def _read_string(self, data: bytes, offset: int) -> Optional[str]:
+    def _read_string(self, data: memoryview, offset: int) -> Optional[str]:
         """
         Read a Rust String from bytes (4-byte little-endian length + UTF-8 data).
 
         Args:
-            data: Byte array
+            data: Account data (memoryview over the decoded bytes)
             offset: Starting offset
 
         Returns:
@@ -292,7 +289,7 @@ class MetadataFetcher:
                 return None
 
             # Read 4-byte little-endian length prefix
-            length = struct.unpack('<I', data[offset:offset + 4])[0]
+            length = _LEN_STRUCT.unpack_from(data, offset)[0]
 
             if length == 0:
                 return None  # Empty string
@@ -300,12 +297,11 @@ class MetadataFetcher:
             if offset + 4 + length > len(data):
                 return None  # Not enough data
 
-            # Read the actual string bytes
-            string_data = data[offset + 4:offset + 4 + length]
-            decoded = string_data.decode('utf-8', errors='ignore').rstrip('\x00').strip()
+            # Decode straight from the view; only the resulting str is allocated
+            decoded = str(data[offset + 4:offset + 4 + length], 'utf-8', 'ignore').rstrip('\x00').strip()
 
             return decoded if decoded else None
 
         except Exception as e:
-            logger.debug(f'Failed to read string at offset {offset}: {e}')
+            logger.debug('Failed to read string at offset %d: %s', offset, e)
             return None
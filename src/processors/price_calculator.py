@@ -1,6 +1,7 @@
 import logging
 from typing import Dict, Optional
 from ..database import ClickHouseClient
+from .token_utils import normalize_tokens
 logger = logging.getLogger(__name__)
 
 # Constants
@@ -10,12 +11,15 @@ STABLECOINS = {
     'USDC': 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v',
     'USDT': 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB'
 }
+STABLECOIN_MINTS = frozenset(STABLECOINS.values())
+STABLECOIN_USD = dict.fromkeys(STABLECOIN_MINTS, 1.0)
 
 class PriceCalculator:
 
     def __init__(self, db_client: ClickHouseClient):
         self.db_client = db_client
         self.sol_price_usd = SOL_PRICE_USD
+        self._usd_per_unit: Optional[Dict[str, float]] = None
 
     def calculate_price(self, token_address: str) -> float:
         try:
@@ -26,7 +30,7 @@ class PriceCalculator:
                 logger.warning(f'No liquid pool found for token {token_address[:8]}...')
                 return 0.0
             price = self._calculate_price_from_pool(token_address, pool_info)
-            logger.debug(f'Token {token_address[:8]}... price: ${price:.6f}')
+            logger.debug('Token %s... price: $%.6f', token_address[:8], price)
             return price
         except Exception as e:
             logger.error(f'Failed to calculate price for {token_address}: {e}')
@@ -36,31 +40,26 @@ class PriceCalculator:
         if not token_addresses:
             return {}
         logger.info(f'Calculating prices for {len(token_addresses)} tokens (batch)')
-        sol_price = self.get_sol_price()
+        sol_price = float(self.get_sol_price())
         last_prices_in_sol = self._get_latest_prices_batch(token_addresses)
-        prices: Dict[str, float] = {}
-        for token, price_in_sol in last_prices_in_sol.items():
-            if price_in_sol is None:
-                prices[token] = 0.0
-            else:
-                prices[token] = float(price_in_sol) * float(sol_price)
+        # Prices already arrive as floats; convert SOL to USD in one comprehension with the rate hoisted
+        prices: Dict[str, float] = {token: price_in_sol * sol_price if price_in_sol is not None else 0.0 for token, price_in_sol in last_prices_in_sol.items()}
         logger.info(f'Calculated prices for {len(prices)} tokens (batch)')
         return prices
 
     def _get_latest_prices_batch(self, token_addresses: list) -> Dict[str, Optional[float]]:
-        if not token_addresses:
+        normalized_tokens = normalize_tokens(token_addresses)
+        if not normalized_tokens:
             return {}
-        normalized_tokens = []
-        for token in token_addresses:
-            t = token.decode('utf-8', errors='ignore') if isinstance(token, (bytes, bytearray)) else str(token)
-            t = t.replace('\x00', '').strip()
-            if t:
-                normalized_tokens.append(t)
-        placeholders = ', '.join([f"'{t}'" for t in normalized_tokens])
-        query = f"\n        SELECT\n            token,\n            argMax(price, block_time) AS last_price_in_sol\n        FROM (\n            -- token is base vs SOL\n            SELECT\n                base_coin AS token,\n                block_time,\n                quote_coin_amount / NULLIF(base_coin_amount, 0) AS price\n            FROM solana.swaps\n            WHERE quote_coin = '{SOL_ADDRESS}' AND base_coin IN ({placeholders})\n\n            UNION ALL\n\n            -- token is quote vs SOL\n            SELECT\n                quote_coin AS token,\n                block_time,\n                base_coin_amount / NULLIF(quote_coin_amount, 0) AS price\n            FROM solana.swaps\n            WHERE base_coin = '{SOL_ADDRESS}' AND quote_coin IN ({placeholders})\n        )\n        GROUP BY token\n        "
+        # The latest (SOL amount, token amount) pair with a non-zero token amount is picked per token and
+        # divided once per group, instead of computing a price for every swap row before argMax
+        query = "\n        WITH\n            {tokens:Array(String)} AS chunk_tokens,\n            argMaxIf((sol_amount, token_amount), block_time, token_amount != 0) AS last_amounts\n        SELECT\n            token,\n            if(last_amounts.2 = 0, NULL, last_amounts.1 / last_amounts.2) AS last_price_in_sol\n        FROM (\n            -- token is base vs SOL\n            SELECT\n                base_coin AS token,\n                block_time,\n                quote_coin_amount AS sol_amount,\n                base_coin_amount AS token_amount\n            FROM solana.swaps\n            WHERE quote_coin = {sol:String} AND base_coin IN chunk_tokens\n\n            UNION ALL\n\n            -- token is quote vs SOL\n            SELECT\n                quote_coin AS token,\n                block_time,\n                base_coin_amount AS sol_amount,\n                quote_coin_amount AS token_amount\n            FROM solana.swaps\n            WHERE base_coin = {sol:String} AND quote_coin IN chunk_tokens\n        )\n        GROUP BY token\n        "
         try:
-            result = self.db_client.execute_query(query)
-            return {row[0]: float(row[1]) if row[1] is not None else None for row in result}
+            # Consume the driver's native column blocks directly instead of transposing them into row tuples
+            prices: Dict[str, Optional[float]] = {}
+            for tokens, last_prices in self.db_client.execute_query_column_stream(query, parameters={'sol': SOL_ADDRESS, 'tokens': normalized_tokens}):
+                prices.update(zip(tokens, (float(price) if price is not None else None for price in last_prices)))
+            return prices
         except Exception as e:
             logger.error(f'Failed to get latest prices batch: {e}')
             return {t: None for t in normalized_tokens}
@@ -79,29 +78,37 @@ class PriceCalculator:
             result = self.db_client.execute_query(query, parameters={'token': token_address})
             if not result:
                 return None
-            best_pool = None
+            best_row = None
             max_liquidity = 0
             for row in result:
-                base_coin, quote_coin, base_balance, quote_balance, base_amount, quote_amount = row
-                liquidity_usd = self._estimate_pool_liquidity(base_coin, quote_coin, base_balance, quote_balance)
+                liquidity_usd = self._estimate_pool_liquidity(row[0], row[1], row[2], row[3])
                 if liquidity_usd > max_liquidity:
                     max_liquidity = liquidity_usd
-                    best_pool = {'base_coin': base_coin, 'quote_coin': quote_coin, 'base_balance': float(base_balance), 'quote_balance': float(quote_balance), 'base_amount': float(base_amount), 'quote_amount': float(quote_amount), 'liquidity_usd': liquidity_usd}
-            return best_pool
+                    best_row = row
+            if best_row is None:
+                return None
+            base_coin, quote_coin, base_balance, quote_balance, base_amount, quote_amount = best_row
+            return {'base_coin': base_coin, 'quote_coin': quote_coin, 'base_balance': float(base_balance), 'quote_balance': float(quote_balance), 'base_amount': float(base_amount), 'quote_amount': float(quote_amount), 'liquidity_usd': max_liquidity}
         except Exception as e:
             logger.error(f'Failed to find liquid pool for {token_address}: {e}')
             return None
 
+    def _get_usd_per_unit(self) -> Dict[str, float]:
+        # USD value of one unit of each reference coin, rebuilt only when the SOL price changes
+        if self._usd_per_unit is None or self._usd_per_unit[SOL_ADDRESS] != self.sol_price_usd:
+            self._usd_per_unit = {SOL_ADDRESS: self.sol_price_usd, **STABLECOIN_USD}
+        return self._usd_per_unit
+
     def _estimate_pool_liquidity(self, base_coin: str, quote_coin: str, base_balance: float, quote_balance: float) -> float:
+        usd_per_unit = self._get_usd_per_unit()
+        base_rate = usd_per_unit.get(base_coin)
+        quote_rate = usd_per_unit.get(quote_coin)
         liquidity = 0.0
-        if base_coin == SOL_ADDRESS:
-            liquidity += base_balance * self.sol_price_usd
-        elif quote_coin == SOL_ADDRESS:
-            liquidity += quote_balance * self.sol_price_usd
-        if base_coin in STABLECOINS.values():
-            liquidity += base_balance
-        elif quote_coin in STABLECOINS.values():
-            liquidity += quote_balance
+        if base_rate is not None:
+            liquidity += base_balance * base_rate
+        # The quote side only adds when it is a different kind of reference coin (SOL vs stablecoin) than the base
+        if quote_rate is not None and (base_rate is None or (base_coin == SOL_ADDRESS) != (quote_coin == SOL_ADDRESS)):
+            liquidity += quote_balance * quote_rate
         return liquidity
 
     def _calculate_price_from_pool(self, token_address: str, pool_info: Dict) -> float:
@@ -111,20 +118,9 @@ class PriceCalculator:
         quote_amount = pool_info['quote_amount']
         if base_amount == 0 or quote_amount == 0:
             return 0.0
+        usd_per_unit = self._get_usd_per_unit()
         if base_coin == token_address:
-            price_in_quote = quote_amount / base_amount
-            if quote_coin == SOL_ADDRESS:
-                return price_in_quote * self.sol_price_usd
-            elif quote_coin in STABLECOINS.values():
-                return price_in_quote
-            else:
-                return 0.0
+            return quote_amount / base_amount * usd_per_unit.get(quote_coin, 0.0)
         elif quote_coin == token_address:
-            price_in_base = base_amount / quote_amount
-            if base_coin == SOL_ADDRESS:
-                return price_in_base * self.sol_price_usd
-            elif base_coin in STABLECOINS.values():
-                return price_in_base
-            else:
-                return 0.0
+            return base_amount / quote_amount * usd_per_unit.get(base_coin, 0.0)
         return 0.0
\ No newline at end of file
@@ -0,0 +1,28 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    json_loads = json.loads
+
+def create_rpc_session() -> requests.Session:
+    # Reuse one keep-alive connection pool for all RPC batches; getAccountInfo is read-only,
+    # so POSTs are safe to retry on connect failures, rate limiting and transient gateway errors.
+    # Read errors are not retried (read=0): a node that hangs until the caller's timeout fails the
+    # batch after one timeout instead of stalling it for several
+    session = requests.Session()
+    retries = Retry(total=3, read=0, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({'POST'}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
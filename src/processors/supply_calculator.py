@@ -1,6 +1,7 @@
 import logging
-from typing import Dict
-from ..database import ClickHouseClient
+from typing import Dict, Tuple
+from ..database import AGGREGATION_SETTINGS, ClickHouseClient
+from .token_utils import POW10, POW10F, normalize_token
 logger = logging.getLogger(__name__)
 
 class SupplyCalculator:
@@ -8,6 +9,8 @@ class SupplyCalculator:
     def __init__(self, db_client: ClickHouseClient):
         self.db_client = db_client
         self._last_minted: Dict[str, int] = {}
+        self._last_burned: Dict[str, int] = {}
+        self._last_raw_supplies: Dict[str, int] = {}
         self.DEFAULT_TOKEN_DECIMALS = 9
         self.SOL_ADDRESS = 'So11111111111111111111111111111111111111112'
         self.STABLECOINS = {'USDC': 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v', 'USDT': 'Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB', 'USDH': 'USDH1SM1ojwWUga67PGrgFWUHibbjqMvuMaDkRJTgkX'}
@@ -29,44 +32,47 @@ class SupplyCalculator:
             return {}
         logger.info(f'Calculating supply for {len(token_addresses)} tokens (batch mode)')
 
-        # Normalize token addresses for filtering
-        normalized_tokens = []
-        for token in token_addresses:
-            t = token.decode('utf-8', errors='ignore') if isinstance(token, (bytes, bytearray)) else str(token)
-            t = t.replace('\x00', '').strip()
-            if t:
-                normalized_tokens.append(t)
+        # Normalize each input once; the unique non-empty addresses are the query filter
+        keys = [normalize_token(token) for token in token_addresses]
+        normalized_tokens = self._unique_tokens(keys)
 
-        minted_amounts = self._get_minted_batch(normalized_tokens)
+        if decimals_map is not None:
+            decimals_lookup, default_decimals = decimals_map, 6
+        else:
+            decimals_lookup, default_decimals = self.TOKEN_DECIMALS, self.DEFAULT_TOKEN_DECIMALS
+        get_decimals = decimals_lookup.get
+
+        minted_amounts, burned_amounts, raw_supplies = self._get_supply_totals_batch(normalized_tokens)
         self._last_minted = minted_amounts
-        burned_amounts = self._get_burned_batch(normalized_tokens)
-        supplies: Dict[str, float] = {}
-        for token in token_addresses:
-            key = token.decode('utf-8', errors='ignore') if isinstance(token, (bytes, bytearray)) else str(token)
-            key = key.replace('\x00', '').strip()
-            minted_raw = int(minted_amounts.get(key, minted_amounts.get(token, 0)))
-            burned_raw = int(burned_amounts.get(key, burned_amounts.get(token, 0)))
-            if decimals_map is not None:
-                decimals = int(decimals_map.get(key, 6))
-            else:
-                decimals = self.TOKEN_DECIMALS.get(key, self.DEFAULT_TOKEN_DECIMALS)
-            supply_final = (minted_raw - burned_raw) / 10 ** decimals
-            supplies[key] = max(0.0, float(supply_final))
+        self._last_burned = burned_amounts
+        self._last_raw_supplies = raw_supplies
+        # Net supplies stay integers until this point; int / int true division rounds once, so large
+        # supplies with 9+ decimals keep full precision. Tokens without mints or burns are zero
+        supplies: Dict[str, float] = dict.fromkeys(keys, 0.0)
+        supplies.update({mint: raw / POW10[int(get_decimals(mint, default_decimals))] for mint, raw in raw_supplies.items()})
         logger.info(f'Calculated supply for {len(supplies)} tokens')
-        logger.info(f'Supplies: {supplies}')
+        logger.debug('Supplies: %s', supplies)
         return supplies
 
+    @staticmethod
+    def _unique_tokens(keys: list) -> list:
+        # Keys are already normalized; first-seen order keeps the bound token array deterministic
+        return [token for token in dict.fromkeys(keys) if token]
+
     def get_last_initial_minted(self) -> Dict[str, int]:
         return dict(self._last_minted)
 
+    def get_last_burned(self) -> Dict[str, int]:
+        return dict(self._last_burned)
+
+    def get_last_raw_supplies(self) -> Dict[str, int]:
+        return dict(self._last_raw_supplies)
+
     def get_last_initial_minted_normalized(self) -> Dict[str, float]:
-        out: Dict[str, float] = {}
-        for k, v in (self._last_minted or {}).items():
-            key = k.decode('utf-8', errors='ignore') if isinstance(k, (bytes, bytearray)) else str(k)
-            key = key.replace('\x00', '').strip()
-            decimals = self.TOKEN_DECIMALS.get(key, self.DEFAULT_TOKEN_DECIMALS)
-            out[key] = float(v) / float(10 ** decimals)
-        return out
+        # Keys are the driver-decoded mint addresses of the batch query, already normalized
+        get_decimals = self.TOKEN_DECIMALS.get
+        default_decimals = self.DEFAULT_TOKEN_DECIMALS
+        return {mint: float(minted) / POW10F[get_decimals(mint, default_decimals)] for mint, minted in self._last_minted.items()}
 
     def _get_total_minted(self, token_address: str) -> int:
         query = '\n        SELECT COALESCE(SUM(amount), 0) as total_minted\n        FROM solana.mints\n        WHERE mint = {mint:String}\n        '
@@ -86,76 +92,52 @@ class SupplyCalculator:
             logger.error(f'Failed to get burned amount for {token_address}: {e}')
             return 0
 
-    def _get_minted_batch(self, token_addresses: list) -> Dict[str, int]:
+    def _get_supply_totals_batch(self, token_addresses: list) -> Tuple[Dict[str, int], Dict[str, int], Dict[str, int]]:
         if not token_addresses:
-            return {}
-
-        # Build WHERE IN clause for specific tokens only
-        placeholders = ', '.join([f"'{t}'" for t in token_addresses])
-        query = f"""
-        SELECT mint, SUM(amount) AS total_minted
-        FROM solana.mints
-        WHERE mint IN ({placeholders})
+            return {}, {}, {}
+
+        # Mints and burns for the batch in one round trip; the has_* flags keep the minted/burned maps
+        # limited to tokens that actually have rows in each table. The net raw supply is computed and
+        # clamped at zero server-side in Int128, so no float rounding happens before decimals scaling
+        query = """
+        WITH
+            {tokens:Array(String)} AS chunk_tokens
+        SELECT
+            mint,
+            SUM(minted) AS total_minted,
+            SUM(burned) AS total_burned,
+            MAX(from_mints) AS has_mints,
+            MAX(from_burns) AS has_burns,
+            greatest(toInt128(total_minted) - toInt128(total_burned), toInt128(0)) AS raw_supply
+        FROM (
+            SELECT mint, amount AS minted, 0 AS burned, 1 AS from_mints, 0 AS from_burns
+            FROM solana.mints
+            WHERE mint IN chunk_tokens
+            UNION ALL
+            SELECT mint, 0 AS minted, amount AS burned, 0 AS from_mints, 1 AS from_burns
+            FROM solana.burns
+            WHERE mint IN chunk_tokens
+        )
         GROUP BY mint
         """
 
-        logger.info(f'Executing minted aggregation for {len(token_addresses)} specific tokens')
+        logger.info(f'Executing minted/burned aggregation for {len(token_addresses)} specific tokens')
         try:
-            result = self.db_client.execute_query(query)
-            logger.info(f'Minted query returned {len(result)} rows')
-
-            # Build dict with proper string handling
+            # Mint addresses arrive as str (FixedString decoded by the driver); rows are read straight
+            # from the streamed column blocks rather than a materialized result set
             minted_map: Dict[str, int] = {}
-            for row in result:
-                mint = row[0]
-                # Normalize bytes to string
-                if isinstance(mint, (bytes, bytearray)):
-                    mint = mint.decode('utf-8', errors='ignore').replace('\x00', '').strip()
-                else:
-                    mint = str(mint)
-
-                amount = int(row[1])
-                minted_map[mint] = amount
-
-            logger.info(f'Built minted map with {len(minted_map)} tokens')
-            return minted_map
-        except Exception as e:
-            logger.error(f'Failed to get total minted amounts: {e}', exc_info=True)
-            return {}
-
-    def _get_burned_batch(self, token_addresses: list) -> Dict[str, int]:
-        if not token_addresses:
-            return {}
-
-        # Build WHERE IN clause for specific tokens only
-        placeholders = ', '.join([f"'{t}'" for t in token_addresses])
-        query = f"""
-        SELECT mint, SUM(amount) AS total_burned
-        FROM solana.burns
-        WHERE mint IN ({placeholders})
-        GROUP BY mint
-        """
-
-        logger.info(f'Executing burned aggregation for {len(token_addresses)} specific tokens')
-        try:
-            result = self.db_client.execute_query(query)
-            logger.info(f'Burned query returned {len(result)} rows')
-
-            # Build dict with proper string handling
             burned_map: Dict[str, int] = {}
-            for row in result:
-                mint = row[0]
-                # Normalize bytes to string
-                if isinstance(mint, (bytes, bytearray)):
-                    mint = mint.decode('utf-8', errors='ignore').replace('\x00', '').strip()
-                else:
-                    mint = str(mint)
-
-                amount = int(row[1])
-                burned_map[mint] = amount
-
-            logger.info(f'Built burned map with {len(burned_map)} tokens')
-            return burned_map
+            supply_map: Dict[str, int] = {}
+            for block in self.db_client.execute_query_column_stream(query, parameters={'tokens': token_addresses}, settings=AGGREGATION_SETTINGS):
+                for mint, total_minted, total_burned, has_mints, has_burns, raw_supply in zip(*block):
+                    if has_mints:
+                        minted_map[mint] = int(total_minted)
+                    if has_burns:
+                        burned_map[mint] = int(total_burned)
+                    supply_map[mint] = int(raw_supply)
+
+            logger.info(f'Built minted map with {len(minted_map)} tokens and burned map with {len(burned_map)} tokens')
+            return minted_map, burned_map, supply_map
         except Exception as e:
-            logger.error(f'Failed to get total burned amounts: {e}', exc_info=True)
-            return {}
\ No newline at end of file
+            logger.error(f'Failed to get total minted/burned amounts: {e}', exc_info=True)
+            return {}, {}, {}
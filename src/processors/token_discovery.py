@@ -1,6 +1,6 @@
 import logging
 from typing import List, Set
-from ..database import ClickHouseClient
+from ..database import AGGREGATION_SETTINGS, ClickHouseClient
 logger = logging.getLogger(__name__)
 
 class TokenDiscovery:
@@ -9,10 +9,15 @@ class TokenDiscovery:
         self.db_client = db_client
 
     def discover_token_mints(self) -> List[str]:
+        # ORDER BY decides which mints fall under the LIMIT, so every run covers the same first
+        # mints by address
         query = "\n        SELECT DISTINCT mint\n        FROM solana.mints\n        WHERE mint IS NOT NULL AND mint != ''\n        ORDER BY mint\n        LIMIT 100\n        "
         try:
-            result = self.db_client.execute_query(query)
-            mints = [row[0] for row in result if row and row[0]]
+            # The driver decodes the FixedString column (NUL padding stripped) block by block,
+            # so the mint column is taken as-is without a per-row pass in Python
+            mints: List[str] = []
+            for (mint_column,) in self.db_client.execute_query_column_stream(query, settings=AGGREGATION_SETTINGS):
+                mints.extend(filter(None, mint_column))
             logger.info(f'Discovered {len(mints)} mints')
             return mints
         except Exception as e:
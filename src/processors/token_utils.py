@@ -0,0 +1,34 @@
+from typing import Iterable, List
+
+# 10 ** decimals for every possible SPL mint decimals value (a u8), so scaling is a tuple index
+POW10 = tuple(10 ** d for d in range(256))
+# The same scales as floats, for dividing already-float amounts without an int conversion per row
+POW10F = tuple(float(p) for p in POW10)
+
+_NUL = b'\x00'
+
+
+def normalize_token(token) -> str:
+    if isinstance(token, (bytes, bytearray)):
+        # Base58 addresses are pure ASCII; bytes.translate drops FixedString NUL padding in C
+        return token.translate(None, _NUL).decode('ascii', errors='ignore').strip()
+    elif not isinstance(token, str):
+        token = str(token)
+    return token.replace('\x00', '').strip()
+
+
+def normalize_tokens(tokens: Iterable) -> List[str]:
+    normalized = []
+    append = normalized.append
+    for token in tokens:
+        # Driver results are already-decoded str (FixedString padding stripped in the driver),
+        # so take that case inline and leave bytes and other types to normalize_token
+        if isinstance(token, str):
+            t = token.replace('\x00', '').strip()
+        elif token is None:
+            continue
+        else:
+            t = normalize_token(token)
+        if t:
+            append(t)
+    return normalized